@@ -0,0 +1,279 @@
+# coding: latin-1
+###############################################################################
+# Gravação e reprodução do tráfego CMD (SOAP) e DSS (REST)
+#
+# cmd_dss_replay.py  (Python 3)
+#
+# Copyright (c) 2020 Devise Futures, Lda.
+# Developed by José Miranda - jose.miranda@devisefutures.com
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+###############################################################################
+
+
+"""
+Gravação e reprodução (offline) das mensagens trocadas com o SCMD e o DSS, nomeadamente
+GetCertificate, CCMovelSign, ValidateOtp, getDataToSign e signDocument (assim como o WSDL).
+
+As mensagens são gravadas num ficheiro gzip com um registo JSON por linha. Nos pedidos SOAP
+são removidos o PIN, o OTP, o ApplicationId, o número de telemóvel do utilizador e o nome
+do documento; dos pedidos REST só é gravado o tamanho. As respostas são gravadas sem
+alterações, necessárias para a reprodução: o ficheiro contém o certificado do titular
+(GetCertificate, com o nome e o número de identificação civil), as assinaturas
+(ValidateOtp) e os PDF assinados (signDocument), devendo ser tratado como dados pessoais.
+Tanto o zeep.Transport como o DSS utilizam um requests.Session, pelo que a gravação e a
+reprodução são feitas através de adaptadores do requests:
+  + record(session, path) - grava as mensagens trocadas através de session;
+  + replay(path, speed) - devolve um requests.Session que responde com as mensagens gravadas.
+
+Permite ainda medir o débito (assinaturas por segundo) do cliente com as mensagens gravadas:
+  python3 cmd_dss_replay.py <ficheiro gravado> <ficheiro PDF> -n <número de assinaturas>
+"""
+
+import sys
+import argparse           # parsing de argumentos comando linha
+import atexit
+import base64
+import contextlib
+import datetime
+import gzip
+import io
+import json
+import re
+import threading
+import time
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlsplit
+
+
+# Elementos SOAP cujo conteúdo não é gravado: PIN (CCMovelSign), OTP (ValidateOtp),
+# ApplicationId da entidade, número de telemóvel do utilizador e nome do documento. São aceites elementos
+# com ou sem prefixo e com atributos (o zeep declara o namespace em cada elemento,
+# <ns4:Pin xmlns:ns4="...">); os elementos vazios (<Pin/>) não têm conteúdo a remover.
+REDACT = re.compile(r'(<(?:[\w.-]+:)?(Pin|code|[Aa]pplicationId|[Uu]serId|DocName)(?:\s[^>]*)?(?<!/)>)'
+                    r'[^<]*(</(?:[\w.-]+:)?\2\s*>)')
+
+
+def operation(request):
+    """Devolve o nome da operação SOAP (SOAPAction) ou REST (último elemento do URL)."""
+    action = request.headers.get('SOAPAction')
+    if action:
+        return action.strip('"').rsplit('/', 1)[-1]
+    return urlsplit(request.url).path.rsplit('/', 1)[-1]
+
+
+def redact(body):
+    """Devolve o corpo do pedido, sem o PIN, o OTP, o ApplicationId, o utilizador e o nome
+    do documento."""
+    if body is None:
+        return ''
+    if isinstance(body, bytes):
+        body = body.decode('UTF-8', 'replace')
+    return REDACT.sub(r'\1***\3', body)
+
+
+class Recorder:
+    """Grava, no ficheiro path, as mensagens trocadas com o SCMD e o DSS."""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'at', encoding='UTF-8')
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, request, response):
+        """Grava o pedido (sem PIN/OTP/ApplicationId/utilizador/nome do documento e, no caso
+        do DSS, sem o PDF) e a resposta (sem alterações: inclui o certificado do titular e
+        o PDF assinado)."""
+        op = operation(request)
+        entry = {
+            'op': op,
+            'method': request.method,
+            'url': request.url,
+            'request_size': len(request.body or b''),
+            'status': response.status_code,
+            'reason': response.reason,
+            'content_type': response.headers.get('Content-Type'),
+            'elapsed': response.elapsed.total_seconds(),
+            'body': base64.b64encode(response.content).decode(),
+        }
+        if request.headers.get('SOAPAction'):
+            entry['request'] = redact(request.body)
+        with self.lock:
+            self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self.file.flush()
+
+    def close(self):
+        """Fecha o ficheiro (terminando o bloco gzip)."""
+        with self.lock:
+            self.file.close()
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Adaptador HTTP que grava as mensagens trocadas no Recorder."""
+
+    def __init__(self, recorder, **kwargs):
+        self.recorder = recorder
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        self.recorder.write(request, response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Adaptador HTTP que responde com as mensagens gravadas no ficheiro path.
+
+    As respostas a um mesmo pedido (método, URL e operação) são devolvidas pela ordem em
+    que foram gravadas, recomeçando no início quando se esgotam. O tempo de resposta
+    gravado é dividido por speed (speed=0 responde de imediato).
+    """
+
+    def __init__(self, path, speed=0):
+        super().__init__()
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.index = {}
+        with gzip.open(path, 'rt', encoding='UTF-8') as file:
+            for line in file:
+                entry = json.loads(line)
+                key = (entry['method'], entry['url'], entry['op'])
+                self.entries.setdefault(key, []).append(entry)
+
+    def send(self, request, **kwargs):
+        key = (request.method, request.url, operation(request))
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                raise requests.ConnectionError('Sem mensagem gravada para ' + ' '.join(key),
+                                               request=request)
+            i = self.index.get(key, 0)
+            self.index[key] = (i + 1) % len(entries)
+        entry = entries[i]
+        if self.speed:
+            time.sleep(entry['elapsed'] / self.speed)
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict()
+        if entry['content_type']:
+            response.headers['Content-Type'] = entry['content_type']
+        response._content = base64.b64decode(entry['body'])
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.elapsed = datetime.timedelta(seconds=entry['elapsed'])
+        return response
+
+    def close(self):
+        pass
+
+
+def record(session, path):
+    """Grava, no ficheiro path, as mensagens trocadas através de session.
+
+    Parameters
+    ----------
+    session : requests.Session
+        Sessão HTTP (zeep.Transport ou DSS) cujas mensagens são gravadas.
+    path : string
+        Ficheiro (gzip) onde são acrescentadas as mensagens.
+
+    Returns
+    -------
+    requests.Session
+        Devolve session.
+
+    """
+    adapter = RecordingAdapter(Recorder(path))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def replay(path, speed=0):
+    """Devolve uma sessão HTTP que responde com as mensagens gravadas no ficheiro path.
+
+    Parameters
+    ----------
+    path : string
+        Ficheiro (gzip) com as mensagens gravadas.
+    speed : float
+        Fator de aceleração do tempo de resposta gravado (0 para responder de imediato).
+
+    Returns
+    -------
+    requests.Session
+        Devolve a sessão, a utilizar no zeep.Transport e nos comandos REST do DSS.
+
+    """
+    adapter = ReplayAdapter(path, speed)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def main():
+    """Mede o débito do cliente (signpdf), com as mensagens gravadas."""
+    import signpdf_config
+    import cmd_soap_msg
+    import signpdf_cli
+
+    parser = argparse.ArgumentParser(description='Replay CMD/DSS recorded traffic')
+    parser.add_argument('trace', action='store', help='recorded traffic file')
+    parser.add_argument('infile', action='store', help='PDF file to sign')
+    parser.add_argument('-n', action='store', type=int, default=100,
+                        help='number of signatures (default: 100)')
+    parser.add_argument('-speed', action='store', type=float, default=0,
+                        help='response time speedup (default: 0, no wait)')
+    parser.add_argument('-user', action='store', default='+351 000000000',
+                        help='user phone number (+XXX NNNNNNNNN)')
+    parser.add_argument('-outfile', action='store', default='replay.signed.pdf',
+                        help='Signed PDF file (default: replay.signed.pdf)')
+    args = parser.parse_args()
+
+    session = replay(args.trace, args.speed)
+    client = cmd_soap_msg.getclient(1, session=session)
+    sign_args = argparse.Namespace(user=args.user, pin='***', infile=args.infile,
+                                   outfile=args.outfile, datetime=None, cache=None,
+                                   applicationId=signpdf_config.get_appid(),
+                                   dss_rest=signpdf_config.get_rest())
+    failed = 0
+    start = time.perf_counter()
+    for i in range(args.n):
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                signpdf_cli.signpdf(client, sign_args, session, lambda prompt: '***')
+        except SystemExit:
+            # signpdf termina com exit() após mostrar o erro
+            failed += 1
+            print('Assinatura %d falhou: %s' % (i + 1, output.getvalue().strip()))
+    elapsed = time.perf_counter() - start
+    print('%d assinaturas (%d falhadas) em %.3f s (%.1f assinaturas/s)' %
+          (args.n, failed, elapsed, args.n / elapsed))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -101,7 +101,7 @@ def get_wsdl(env):
 
 
 # Função que devolve o cliente de ligação (preprod ou prod) ao servidor SOAP da CMD
-def getclient(env=0, timeout=10):
+def getclient(env=0, timeout=10, session=None):
     """Devolve o cliente de ligação ao servidor SOAP da CMD.
 
     Parameters
@@ -110,6 +110,9 @@ def getclient(env=0, timeout=10):
         WSDL a devolver: 0 para preprod, 1 para prod.
     timeout: int
         Valor máximo que espera para estabelever ligação com o servidor SOAP da CMD
+    session: requests.Session
+        Sessão HTTP a utilizar no Transport (por exemplo, para gravar ou reproduzir as
+        mensagens, ver cmd_dss_replay).
 
     Returns
     -------
@@ -118,7 +121,7 @@ def getclient(env=0, timeout=10):
         servidor de preprod.
 
     """
-    transport = Transport(timeout=timeout)
+    transport = Transport(timeout=timeout, session=session)
     return Client(get_wsdl(env), transport=transport)
 
 
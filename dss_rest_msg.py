@@ -38,6 +38,95 @@ Funções que preparam e executam os comandos REST do DSS, nomeadamente:
 import hashlib            # hash SHA256
 import requests
 import base64
+import copy
+
+
+# Parâmetros de assinatura comuns ao getDataToSign e signDocument (sem os certificados e
+# a data de assinatura, acrescentados por signature_parameters)
+SIGNATURE_PARAMETERS = {
+    "signWithExpiredCertificate": False,
+    "generateTBSWithoutCertificate": False,
+    "signatureLevel": "PAdES_BASELINE_B",
+    "signaturePackaging": "ENVELOPED",
+    "encryptionAlgorithm": "RSA",
+    "digestAlgorithm": "SHA256",
+    "referenceDigestAlgorithm": None,
+    "maskGenerationFunction": None,
+    "detachedContents": None,
+    "asicContainerType": None,
+    "blevelParams": {
+        "trustAnchorBPPolicy": True,
+        "claimedSignerRoles": None,
+        "commitmentTypeIndications": None
+    }
+}
+
+# Algoritmo da assinatura devolvida pela CMD (signDocument)
+SIGNATURE_ALGORITHM = "RSA_SHA256"
+
+
+# Função que devolve a sessão HTTP (reutiliza ligações) para o servidor DSS
+def getsession():
+    """Devolve a sessão HTTP a utilizar nos comandos REST do DSS.
+
+    Returns
+    -------
+    requests.Session
+        Sessão HTTP, que mantém as ligações abertas ao servidor DSS entre pedidos.
+
+    """
+    return requests.Session()
+
+
+# Função que (re)estabelece a ligação (TCP/TLS) ao servidor DSS antes do signDocument
+def warmup(dss_rest, session):
+    """(Re)estabelece a ligação ao servidor DSS, para que o signDocument a reutilize.
+
+    Depois da espera do OTP, a ligação mantida na sessão pode ter sido fechada pelo
+    servidor (keep-alive expirado). O pedido OPTIONS ao signDocument (respondido pelo DSS
+    sem executar o comando) volta a abri-la, em paralelo com o ValidateOtp.
+
+    Parameters
+    ----------
+    dss_rest: URI
+        Servidor DSS Rest - Web Services
+    session: requests.Session
+        Sessão HTTP onde fica a ligação estabelecida.
+
+    """
+    try:
+        session.options(dss_rest + '/signDocument', timeout=10)
+    except requests.RequestException:
+        pass  # o signDocument estabelece a ligação
+
+
+# Função que devolve os parâmetros de assinatura (ns0:remoteSignatureParameters)
+def signature_parameters(certs_chain, signdate):
+    """Devolve os parâmetros de assinatura, a partir de SIGNATURE_PARAMETERS.
+
+    Parameters
+    ----------
+    certs_chain : array de certificados
+        Contém certificado de assinatura, EC intermédia e Root.
+    signdate : datetime, em formato ISO
+        Data e hora de assinatura em formato ISO.
+
+    Returns
+    -------
+    ns0:remoteSignatureParameters
+        Devolve os parâmetros de assinatura, com os certificados e a data de assinatura.
+
+    """
+    parameters = copy.deepcopy(SIGNATURE_PARAMETERS)
+    parameters["signingCertificate"] = {
+        "encodedCertificate": certs_chain['sign']
+    }
+    parameters["certificateChain"] = [
+        {"encodedCertificate": certs_chain['root']},
+        {"encodedCertificate": certs_chain['ca']}
+    ]
+    parameters["blevelParams"]["signingDate"] = signdate
+    return parameters
 
 
 # getDataToSign(dataToSignDTO: ns0:dataToSignOneDocumentDTO) -> response: ns0:toBeSignedDTO
@@ -75,7 +164,7 @@ import base64
 # ns0:timestampIncludeDTO(referencedData: xsd:boolean, URI: xsd:string)
 # ns0:remoteDocument(bytes: xsd:base64Binary, digestAlgorithm: ns0:digestAlgorithm, name: xsd:string)
 # ns0:toBeSignedDTO(bytes: xsd:base64Binary)
-def getDataToSign(certs_chain, signdate, pdf, dss_rest):
+def getDataToSign(certs_chain, signdate, pdf, dss_rest, session=requests):
     """Prepara e executa o comando DSS getDataToSign.
 
     Parameters
@@ -88,6 +177,8 @@ def getDataToSign(certs_chain, signdate, pdf, dss_rest):
         PDF a assinar e nome do ficheiro de onde foi lido.
     dss_rest: URI
         Servidor DSS Rest - Web Services
+    session: requests.Session
+        Sessão HTTP a utilizar (por defeito, uma nova ligação por pedido).
 
     Returns
     -------
@@ -95,37 +186,13 @@ def getDataToSign(certs_chain, signdate, pdf, dss_rest):
         Devolve o DTBS (i.e., Data to be signed) do PDF.
     """
     request_data = {
-        "parameters": {
-            "signWithExpiredCertificate": False,
-            "generateTBSWithoutCertificate": False,
-            "signatureLevel": "PAdES_BASELINE_B",
-            "signaturePackaging": "ENVELOPED",
-            "encryptionAlgorithm": "RSA",
-            "digestAlgorithm": "SHA256",
-            "referenceDigestAlgorithm": None,
-            "maskGenerationFunction": None,
-            "signingCertificate": {
-                "encodedCertificate": certs_chain['sign']
-            },
-            "certificateChain": [
-                {"encodedCertificate": certs_chain['root']},
-                {"encodedCertificate": certs_chain['ca']}
-            ],
-            "detachedContents": None,
-            "asicContainerType": None,
-            "blevelParams": {
-                "trustAnchorBPPolicy": True,
-                "signingDate": signdate,
-                "claimedSignerRoles": None,
-                "commitmentTypeIndications": None
-            }
-        },
+        "parameters": signature_parameters(certs_chain, signdate),
         "toSignDocument": {
             "bytes": base64.b64encode(pdf['bytes']).decode(),
             "name": pdf['name'],
         }
     }
-    return requests.post(dss_rest + '/getDataToSign', json=request_data)
+    return session.post(dss_rest + '/getDataToSign', json=request_data)
 
 
 # signDocument(signDocumentDTO: ns0:signOneDocumentDTO) -> response: ns0:remoteDocument
@@ -162,8 +229,8 @@ def getDataToSign(certs_chain, signdate, pdf, dss_rest):
 # ns0:timestampDTO(binaries: xsd:base64Binary, canonicalizationMethod: xsd:string,
 #       includes: ns0:timestampIncludeDTO[], type: ns0:timestampType)
 # ns0:remoteDocument(bytes: xsd:base64Binary, digestAlgorithm: ns0:digestAlgorithm, name: xsd:string)
-def signDocument(certs_chain, signdate, pdf, res, dss_rest):
-    """Prepara e executa o comando DSS getDataToSign.
+def signDocument(certs_chain, signdate, pdf, res, dss_rest, session=requests):
+    """Prepara e executa o comando DSS signDocument.
 
     Parameters
     ----------
@@ -177,6 +244,8 @@ def signDocument(certs_chain, signdate, pdf, res, dss_rest):
         Assinatura do PDF
     dss_rest: URI
         Servidor DSS Rest - Web Services
+    session: requests.Session
+        Sessão HTTP a utilizar (por defeito, uma nova ligação por pedido).
 
     Returns
     -------
@@ -184,33 +253,9 @@ def signDocument(certs_chain, signdate, pdf, res, dss_rest):
         Devolve uma estrutura com o PDF assinado (bytes).
     """
     request_data = {
-        "parameters": {
-            "signWithExpiredCertificate": False,
-            "generateTBSWithoutCertificate": False,
-            "signatureLevel": "PAdES_BASELINE_B",
-            "signaturePackaging": "ENVELOPED",
-            "encryptionAlgorithm": "RSA",
-            "digestAlgorithm": "SHA256",
-            "referenceDigestAlgorithm": None,
-            "maskGenerationFunction": None,
-            "signingCertificate": {
-                "encodedCertificate": certs_chain['sign']
-            },
-            "certificateChain": [
-                {"encodedCertificate": certs_chain['root']},
-                {"encodedCertificate": certs_chain['ca']}
-            ],
-            "detachedContents": None,
-            "asicContainerType": None,
-            "blevelParams": {
-                "trustAnchorBPPolicy": True,
-                "signingDate": signdate,
-                "claimedSignerRoles": None,
-                "commitmentTypeIndications": None
-            }
-        },
+        "parameters": signature_parameters(certs_chain, signdate),
         "signatureValue": {
-            "algorithm": "RSA_SHA256",
+            "algorithm": SIGNATURE_ALGORITHM,
             "value": base64.b64encode(res['Signature']).decode()
         },
         "toSignDocument": {
@@ -218,4 +263,4 @@ def signDocument(certs_chain, signdate, pdf, res, dss_rest):
             "name": pdf['name'],
         }
     }
-    return requests.post(dss_rest + '/signDocument', json=request_data)
+    return session.post(dss_rest + '/signDocument', json=request_data)
@@ -0,0 +1,180 @@
+# coding: latin-1
+###############################################################################
+# Cache de documentos assinados (deduplicação por conteúdo)
+#
+# signpdf_cache.py  (Python 3)
+#
+# Copyright (c) 2020 Devise Futures, Lda.
+# Developed by José Miranda - jose.miranda@devisefutures.com
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+###############################################################################
+
+
+"""
+Deduplicação de documentos idênticos a assinar, nomeadamente:
+  + cache_key - chave do documento (SHA256 do PDF, utilizador, data de assinatura,
+        certificado de assinatura e parâmetros de assinatura do DSS);
+  + SignCache - cache em disco dos PDF assinados, com tamanho máximo e remoção LRU.
+"""
+
+import hashlib            # hash SHA256
+import json
+import os
+import stat
+import tempfile
+
+import dss_rest_msg
+
+
+# Tamanho máximo, por defeito, da cache em disco (bytes)
+MAXSIZE = 100 * 1024 * 1024
+
+
+def cache_key(pdf, user, signdate, certs_chain):
+    """Devolve a chave do documento a assinar.
+
+    A chave inclui os parâmetros de assinatura definidos em dss_rest_msg, pelo que uma
+    alteração desses parâmetros (ou do certificado de assinatura) não reutiliza os PDF
+    assinados anteriormente.
+
+    Parameters
+    ----------
+    pdf : byte
+        PDF a assinar.
+    user : string
+        Utilizador CMD (número de telemóvel).
+    signdate : datetime, em formato ISO
+        Data e hora de assinatura em formato ISO.
+    certs_chain : array de certificados
+        Contém certificado de assinatura, EC intermédia e Root.
+
+    Returns
+    -------
+    string
+        Devolve a chave (hexadecimal) do documento.
+
+    """
+    params = json.dumps([dss_rest_msg.SIGNATURE_PARAMETERS, dss_rest_msg.SIGNATURE_ALGORITHM],
+                        sort_keys=True)
+    key = hashlib.sha256()
+    key.update(hashlib.sha256(pdf).digest())
+    for field in (user, signdate, certs_chain['sign'], params):
+        key.update(b'\0' + field.encode('UTF-8'))
+    return key.hexdigest()
+
+
+class SignCache:
+    """Cache em disco dos PDF assinados, com tamanho máximo e remoção LRU.
+
+    Cada PDF assinado é guardado no ficheiro <directory>/<key>.pdf (só acessível ao
+    utilizador). A data de
+    modificação do ficheiro é atualizada em cada acesso, sendo removidos os ficheiros
+    acedidos há mais tempo quando a cache excede maxsize bytes.
+    """
+
+    def __init__(self, directory, maxsize=MAXSIZE):
+        """Inicializa a cache na diretoria directory (criada, caso não exista).
+
+        A chave de cada entrada é obtida de dados públicos, pelo que quem puder escrever na
+        diretoria pode colocar um PDF que seria devolvido como assinado. Por isso, a
+        diretoria tem de pertencer ao utilizador e não ter permissões de grupo ou outros.
+
+        Raises
+        ------
+        PermissionError
+            Se a diretoria não pertence ao utilizador ou tem permissões de grupo/outros.
+
+        """
+        self.directory = directory
+        self.maxsize = maxsize
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.stat(directory)
+        if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+            raise PermissionError('Diretoria de cache ' + directory +
+                                  ' não pertence ao utilizador.')
+        if st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            raise PermissionError('Diretoria de cache ' + directory +
+                                  ' acessível a outros utilizadores (utilize chmod 700).')
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pdf')
+
+    def get(self, key):
+        """Devolve o PDF assinado com a chave key, ou None se não estiver na cache."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        """Guarda o PDF assinado data com a chave key, removendo as entradas LRU.
+
+        Returns
+        -------
+        bool
+            Devolve False se não foi possível guardar o PDF (por exemplo, disco cheio).
+
+        """
+        try:
+            (fd, tmp) = tempfile.mkstemp(suffix='.tmp', dir=self.directory)   # modo 0600
+        except OSError:
+            return False
+        try:
+            with open(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """Remove as entradas acedidas há mais tempo, até a cache ter no máximo maxsize bytes."""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith('.pdf'):
+                        continue
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue        # removida entretanto por outro processo
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            return
+        entries.sort()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -38,16 +38,23 @@ import json
 import re
 import os
 import logging              # debug
+from concurrent.futures import ThreadPoolExecutor   # pedidos em paralelo
 
 
 import signpdf_config
 import dss_rest_msg
 import cmd_soap_msg
+import signpdf_cache
+import cmd_dss_replay
+import signpdf_session
 
 
 TEXT = 'PDF PAdES (DSS & CMD) signature Command Line Program, by DeviseFutures, Lda.'
 VERSION = 'version: 1.0'
 
+# Sessões de assinatura pendentes (à espera do OTP)
+SESSIONS = signpdf_session.SessionStore()
+
 
 def main():
     """Função main do programa."""
@@ -55,13 +62,18 @@ def main():
     if len(sys.argv) > 1:
         if args.debug:
             logging.basicConfig(level=logging.DEBUG)
-        client = cmd_soap_msg.getclient(1)
+        session = None
+        if args.replay:
+            session = cmd_dss_replay.replay(args.replay)
+        elif args.record:
+            session = cmd_dss_replay.record(dss_rest_msg.getsession(), args.record)
+        client = cmd_soap_msg.getclient(1, session=session)
         args.applicationId = signpdf_config.get_appid()
         args.dss_rest = signpdf_config.get_rest()
         if args.outfile is None:
             (h, t) = os.path.splitext(args.infile)
             args.outfile = h + ".signed" + t
-        signpdf(client, args)
+        signpdf(client, args, session)
     else:
         print('Use -h for usage:\n  ', sys.argv[0], '-h')
 
@@ -79,18 +91,75 @@ def args_parse():
                         help='Signed PDF file (default: <infile>.signed.pdf)')
     parser.add_argument('-datetime', action='store',
                         help='"DD/MM/YYYY hh:mm:ss" format (default: current time and date)')
+    parser.add_argument('-cache', action='store',
+                        help='directory of signed PDF cache (reuses signatures of identical documents)')
+    parser.add_argument('-record', action='store',
+                        help='record CMD/DSS messages to file (includes the holder certificate and signed PDF)')
+    parser.add_argument('-replay', action='store',
+                        help='replay CMD/DSS messages recorded with -record (offline)')
     parser.add_argument(
         '-D', '--debug', help='show debug information', action='store_true')
     return parser.parse_args()
 
 
-def signpdf(client, args):
+def check_files(args):
+    """Valida o ficheiro PDF a assinar e o ficheiro onde gravar o PDF assinado.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parâmetros passado pelo comando linha.
+
+    Returns
+    -------
+    string
+        Devolve None se os ficheiros são válidos, caso contrário a mensagem de erro.
+
+    """
+    if not os.path.isfile(args.infile) or not os.access(args.infile, os.R_OK):
+        return "Ficheiro " + args.infile + " não encontrado."
+    outdir = os.path.dirname(os.path.abspath(args.outfile))
+    if os.path.isdir(args.outfile) or not os.access(outdir, os.W_OK) or \
+            (os.path.exists(args.outfile) and not os.access(args.outfile, os.W_OK)):
+        return "Impossível gravar o ficheiro " + args.outfile + "."
+    return None
+
+
+def read_file(infile):
+    """Lê o ficheiro PDF a assinar.
+
+    Parameters
+    ----------
+    infile : string
+        Nome do ficheiro PDF.
+
+    Returns
+    -------
+    dictionary
+        Devolve o PDF (bytes) e o nome do ficheiro de onde foi lido.
+
+    """
+    with open(infile, "rb") as file:
+        return {'bytes': file.read(), 'name': infile}
+
+
+def signpdf(client, args, session=None, otp_input=input):
     """Assina o PDF em formato PAdES, recorrendo ao DSS e CMD.
 
+    O GetCertificate e a leitura do PDF são executados em paralelo, e a ligação ao DSS é
+    restabelecida em paralelo com o ValidateOtp. Durante a espera do OTP, o estado
+    da assinatura é guardado numa SigningSession (o PDF não é mantido em memória).
+
     Parameters
     ----------
+    client : Client (zeep)
+        Client inicializado com o WSDL.
     args : dictionary
         Parâmetros passado pelo comando linha.
+    session : requests.Session
+        Sessão HTTP a utilizar nos comandos REST do DSS (por defeito, uma nova sessão).
+    otp_input : função
+        Função que pede o OTP ao utilizador (por defeito, input).
 
     Returns
     -------
@@ -98,28 +167,11 @@ def signpdf(client, args):
         Devolve 0 na conclusão com sucesso da função.
 
     """
-    # Obtém cadeia de certificados CMD
-    cmd_certs = cmd_soap_msg.getcertificate(client, args)
-    if cmd_certs is None:
-        print('Impossível obter certificado CMD')
-        exit()
-
-    # certs[0] = user; certs[1] = root; certs[2] = CA
-    certs = pem.parse(cmd_certs.encode())
-
-    certs_chain = {'sign': re.sub('\s*-----\s*(BEGIN|END) CERTIFICATE\s*-----\s*', '', certs[0].as_text()). replace('\n', ''),
-                   'ca': re.sub('\s*-----\s*(BEGIN|END) CERTIFICATE\s*-----\s*', '', certs[2].as_text()).replace('\n', ''),
-                   'root': re.sub('\s*-----\s*(BEGIN|END) CERTIFICATE\s*-----\s*', '', certs[1].as_text()).replace('\n', '')
-                   }
-
-    # Lê ficheiro PDF
-    try:
-        with open(args.infile, "rb") as file:
-            pdf_file = file.read()
-    except Exception as e:
-        print("Ficheiro " + args.infile + " não encontrado.")
+    # Valida ficheiros antes de qualquer pedido aos servidores
+    error = check_files(args)
+    if error is not None:
+        print(error)
         exit()
-    pdf = {'bytes': pdf_file, 'name': args.infile}
 
     # Identifica hora/data de assinatura
     if args.datetime:
@@ -128,33 +180,109 @@ def signpdf(client, args):
     else:
         signdate = datetime.now().isoformat()
 
-    # Obtém o DTBS do PDF e gera a hash a assinar
-    response = dss_rest_msg.getDataToSign(
-        certs_chain, signdate, pdf, args.dss_rest)
-    dtbs = response.json()['bytes']
-    args.hash = hashlib.sha256(base64.b64decode(dtbs)).digest()
-    args.docName = args.infile
-
-    # Obtém assinatura da hash
-    res = cmd_soap_msg.ccmovelsign(client, args)
-    if res['Code'] != '200':
-        print('Erro ' + res['Code'] + '. Valide o PIN introduzido.')
-        exit()
-    vars(args)['ProcessId'] = res['ProcessId']
-    vars(args)['OTP'] = input('Introduza o OTP recebido no seu dispositivo: ')
-    res = cmd_soap_msg.validate_otp(client, args)
-    if res['Status']['Code'] != '200':
-        print('Erro ' + res['Status']['Code'] +
-              '. ' + res['Status']['Message'])
-        exit()
+    # Cache de PDF assinados, só com data de assinatura fixa (-datetime): com a data atual
+    # a chave nunca se repete
+    cache = None
+    if getattr(args, 'cache', None) and args.datetime:
+        try:
+            cache = signpdf_cache.SignCache(args.cache)
+        except OSError as e:
+            print(str(e))
+            exit()
+
+    if session is None:
+        session = dss_rest_msg.getsession()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # Obtém cadeia de certificados CMD e lê ficheiro PDF, em paralelo
+        cert_future = executor.submit(cmd_soap_msg.getcertificate, client, args)
+        pdf_future = executor.submit(read_file, args.infile)
+        try:
+            pdf = pdf_future.result()
+        except Exception as e:
+            print("Ficheiro " + args.infile + " não encontrado.")
+            exit()
+
+        cmd_certs = cert_future.result()
+        if cmd_certs is None:
+            print('Impossível obter certificado CMD')
+            exit()
+
+        # certs[0] = user; certs[1] = root; certs[2] = CA
+        certs = pem.parse(cmd_certs.encode())
+
+        certs_chain = {'sign': re.sub('\s*-----\s*(BEGIN|END) CERTIFICATE\s*-----\s*', '', certs[0].as_text()). replace('\n', ''),
+                       'ca': re.sub('\s*-----\s*(BEGIN|END) CERTIFICATE\s*-----\s*', '', certs[2].as_text()).replace('\n', ''),
+                       'root': re.sub('\s*-----\s*(BEGIN|END) CERTIFICATE\s*-----\s*', '', certs[1].as_text()).replace('\n', '')
+                       }
+
+        # Documento idêntico já assinado (mesmo utilizador, data, certificado e parâmetros).
+        # A reutilização não verifica o PIN nem o OTP: o PDF assinado foi produzido com a
+        # autenticação do titular e a diretoria da cache só é acessível ao utilizador.
+        if cache is not None:
+            key = signpdf_cache.cache_key(pdf['bytes'], args.user, signdate, certs_chain)
+            signed = cache.get(key)
+            if signed is not None:
+                with open(args.outfile, 'wb') as file:
+                    file.write(signed)
+                print("Aviso: assinatura reutilizada da cache " + args.cache +
+                      " (PIN e OTP não verificados).")
+                print("Ficheiro assinado anteriormente (cache) guardado em " + args.outfile)
+                return 0
+
+        # Obtém o DTBS do PDF e gera a hash a assinar
+        response = dss_rest_msg.getDataToSign(
+            certs_chain, signdate, pdf, args.dss_rest, session)
+        dtbs = response.json()['bytes']
+        sign_session = signpdf_session.SigningSession(
+            hashlib.sha256(base64.b64decode(dtbs)).digest(), args.infile,
+            hashlib.sha256(pdf['bytes']).digest(), signdate)
+        # Durante a espera do OTP não são mantidos o PDF nem os certificados (só a
+        # SigningSession e a cadeia de certificados partilhada em SESSIONS)
+        del pdf, pdf_future, dtbs, response, cmd_certs, certs, cert_future
+
+        # Obtém assinatura da hash
+        res = cmd_soap_msg.ccmovelsign(client, argparse.Namespace(
+            applicationId=args.applicationId, user=args.user, pin=args.pin,
+            hash=sign_session.hash, docName=sign_session.path))
+        if res['Code'] != '200':
+            print('Erro ' + res['Code'] + '. Valide o PIN introduzido.')
+            exit()
+        sign_session.process_id = res['ProcessId']
+        SESSIONS.add(sign_session, certs_chain)
+        del sign_session, certs_chain
+        otp = otp_input('Introduza o OTP recebido no seu dispositivo: ')
+        # Restabelece a ligação ao DSS (fechada durante a espera do OTP), em paralelo
+        # com o ValidateOtp
+        executor.submit(dss_rest_msg.warmup, args.dss_rest, session)
+        (sign_session, certs_chain) = SESSIONS.pop(res['ProcessId'])
+        if sign_session is None:
+            print('Erro. OTP expirado.')
+            exit()
+        # Lê novamente o PDF, que tem de ser o PDF de onde foi obtido o DTBS assinado
+        try:
+            pdf = read_file(sign_session.path)
+        except OSError:
+            pdf = None
+        if pdf is None or not sign_session.check(pdf['bytes']):
+            print("Ficheiro " + sign_session.path + " alterado durante a assinatura.")
+            exit()
+        res = cmd_soap_msg.validate_otp(client, argparse.Namespace(
+            applicationId=args.applicationId, ProcessId=sign_session.process_id, OTP=otp))
+        if res['Status']['Code'] != '200':
+            print('Erro ' + res['Status']['Code'] +
+                  '. ' + res['Status']['Message'])
+            exit()
 
-    # Assina PDF
-    response = dss_rest_msg.signDocument(
-        certs_chain, signdate, pdf, res, args.dss_rest)
+        # Assina PDF
+        response = dss_rest_msg.signDocument(
+            certs_chain, sign_session.signdate, pdf, res, args.dss_rest, session)
 
     # Grava PDF
+    signed = base64.b64decode(response.json()['bytes'])
     with open(args.outfile, 'wb') as file:
-        file.write(base64.b64decode(response.json()['bytes']))
+        file.write(signed)
+    if cache is not None and not cache.put(key, signed):
+        print("Aviso: não foi possível guardar o ficheiro assinado na cache " + args.cache)
     print("Ficheiro assinado guardado em " + args.outfile)
 
 
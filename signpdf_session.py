@@ -0,0 +1,168 @@
+# coding: latin-1
+###############################################################################
+# Sessões de assinatura (estado entre o CCMovelSign e o ValidateOtp)
+#
+# signpdf_session.py  (Python 3)
+#
+# Copyright (c) 2020 Devise Futures, Lda.
+# Developed by José Miranda - jose.miranda@devisefutures.com
+#
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+###############################################################################
+
+
+"""
+Sessões de assinatura pendentes (à espera do OTP), nomeadamente:
+  + SigningSession - registo (__slots__) com a hash do DTBS, o ProcessId, a referência
+        ao certificado, o nome do ficheiro PDF e a hash do PDF (o PDF não é mantido em
+        memória, sendo lido novamente e verificado para o signDocument);
+  + SessionStore - sessões pendentes, com a cadeia de certificados partilhada entre
+        sessões e remoção das sessões expiradas (índice por data de expiração).
+"""
+
+import hashlib            # hash SHA256
+import heapq
+import sys
+import threading
+import time
+
+
+# Tempo de vida (segundos) de uma sessão pendente (validade do OTP)
+TTL = 300
+
+
+class SigningSession:
+    """Estado de uma assinatura pendente, entre o CCMovelSign e o ValidateOtp."""
+
+    __slots__ = ('hash', 'process_id', 'cert_ref', 'path', 'digest', 'signdate', 'expires')
+
+    def __init__(self, hash, path, digest, signdate, ttl=TTL):
+        """Inicializa a sessão.
+
+        Parameters
+        ----------
+        hash : byte
+            hash SHA256 do DTBS (i.e., Data to be signed) do PDF.
+        path : string
+            Nome do ficheiro PDF a assinar.
+        digest : byte
+            hash SHA256 do PDF lido para o getDataToSign.
+        signdate : datetime, em formato ISO
+            Data e hora de assinatura em formato ISO.
+        ttl : int
+            Tempo de vida (segundos) da sessão.
+
+        """
+        self.hash = hash
+        self.process_id = None
+        self.cert_ref = None      # hash SHA256 do certificado de assinatura (SessionStore)
+        self.path = path
+        self.digest = digest
+        self.signdate = signdate
+        self.expires = time.monotonic() + ttl
+
+    def check(self, pdf):
+        """Verifica se o PDF (lido novamente de path) é o PDF de onde foi obtido o DTBS."""
+        return hashlib.sha256(pdf).digest() == self.digest
+
+    def sizeof(self):
+        """Devolve a memória (bytes) ocupada pela sessão e pelos seus campos."""
+        return sys.getsizeof(self) + sum(sys.getsizeof(getattr(self, name))
+                                         for name in self.__slots__)
+
+
+def _budget():
+    """Mede a memória (bytes) de uma sessão típica: hashes e certificado SHA256, ProcessId
+    (GUID), nome de ficheiro com 64 caracteres e data ISO."""
+    session = SigningSession(bytes(32), 'x' * 64, bytes(32), '2020-01-01T00:00:00.000000')
+    session.process_id = '00000000-0000-0000-0000-000000000000'
+    session.cert_ref = bytes(32)
+    return session.sizeof()
+
+
+# Memória (bytes) prevista por sessão pendente (sem a cadeia de certificados, partilhada
+# entre as sessões do mesmo certificado)
+BUDGET = _budget()
+
+
+class SessionStore:
+    """Sessões de assinatura pendentes, indexadas pelo ProcessId.
+
+    A cadeia de certificados é guardada uma única vez por certificado de assinatura, e
+    as sessões expiradas são removidas (por ordem de expiração) em cada add.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.certs = {}           # cert_ref -> [cadeia de certificados, nº de sessões]
+        self.expiry = []          # heap (expires, process_id)
+        self.lock = threading.Lock()
+
+    def add(self, session, certs_chain):
+        """Adiciona a sessão (com process_id definido) e remove as sessões expiradas.
+
+        Parameters
+        ----------
+        session : SigningSession
+            Sessão de assinatura pendente.
+        certs_chain : array de certificados
+            Contém certificado de assinatura, EC intermédia e Root.
+
+        """
+        session.cert_ref = hashlib.sha256(certs_chain['sign'].encode()).digest()
+        with self.lock:
+            self._expire(time.monotonic())
+            self._remove(session.process_id)
+            self.sessions[session.process_id] = session
+            self.certs.setdefault(session.cert_ref, [certs_chain, 0])[1] += 1
+            heapq.heappush(self.expiry, (session.expires, session.process_id))
+
+    def pop(self, process_id):
+        """Remove e devolve a sessão process_id e a sua cadeia de certificados.
+
+        Returns
+        -------
+        (SigningSession, array de certificados)
+            Devolve (None, None) se a sessão não existe ou expirou.
+
+        """
+        with self.lock:
+            self._expire(time.monotonic())
+            session = self.sessions.get(process_id)
+            if session is None:
+                return (None, None)
+            certs_chain = self.certs[session.cert_ref][0]
+            self._remove(process_id)
+            return (session, certs_chain)
+
+    def _remove(self, process_id):
+        session = self.sessions.pop(process_id, None)
+        if session is not None:
+            entry = self.certs[session.cert_ref]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.certs[session.cert_ref]
+
+    def _expire(self, now):
+        while self.expiry and self.expiry[0][0] <= now:
+            (expires, process_id) = heapq.heappop(self.expiry)
+            session = self.sessions.get(process_id)
+            if session is not None and session.expires == expires:
+                self._remove(process_id)
+
+    def __len__(self):
+        return len(self.sessions)
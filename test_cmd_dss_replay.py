@@ -0,0 +1,387 @@
+# coding: latin-1
+"""Testes da gravação e reprodução das mensagens SCMD (cmd_dss_replay)."""
+
+import argparse
+import base64
+import contextlib
+import gzip
+import http.server
+import io
+import json
+import os
+import tempfile
+import threading
+import sys
+import types
+import unittest
+from unittest import mock
+
+import requests
+from zeep import Client
+from zeep.transports import Transport
+
+import _signpdf_config
+sys.modules.setdefault('signpdf_config', _signpdf_config)   # signpdf_config.py (local)
+import cmd_dss_replay
+import cmd_soap_msg
+import dss_rest_msg
+import signpdf_cli
+
+
+SERVICE = 'http://Ama.Authentication.Service/'
+STRUCTURES = 'http://schemas.datacontract.org/2004/07/Ama.Structures.CCMovelSignature'
+
+# Extrato do WSDL do SCMD (GetCertificate, CCMovelSign e ValidateOtp)
+WSDL = '''<?xml version="1.0" encoding="utf-8"?>
+<wsdl:definitions targetNamespace="%(svc)s" xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="%(svc)s" xmlns:q1="%(st)s">
+  <wsdl:types>
+    <xs:schema elementFormDefault="qualified" targetNamespace="%(st)s">
+      <xs:complexType name="SignRequest"><xs:sequence>
+        <xs:element minOccurs="0" name="ApplicationId" type="xs:base64Binary"/>
+        <xs:element minOccurs="0" name="DocName" type="xs:string"/>
+        <xs:element minOccurs="0" name="Hash" type="xs:base64Binary"/>
+        <xs:element minOccurs="0" name="Pin" type="xs:string"/>
+        <xs:element minOccurs="0" name="UserId" type="xs:string"/>
+      </xs:sequence></xs:complexType>
+      <xs:complexType name="SignStatus"><xs:sequence>
+        <xs:element minOccurs="0" name="Code" type="xs:string"/>
+        <xs:element minOccurs="0" name="Message" type="xs:string"/>
+        <xs:element minOccurs="0" name="ProcessId" type="xs:string"/>
+      </xs:sequence></xs:complexType>
+      <xs:complexType name="SignResponse"><xs:sequence>
+        <xs:element minOccurs="0" name="Signature" type="xs:base64Binary"/>
+        <xs:element minOccurs="0" name="Status" type="q1:SignStatus"/>
+      </xs:sequence></xs:complexType>
+    </xs:schema>
+    <xs:schema elementFormDefault="qualified" targetNamespace="%(svc)s">
+      <xs:import namespace="%(st)s"/>
+      <xs:element name="GetCertificate"><xs:complexType><xs:sequence>
+        <xs:element minOccurs="0" name="applicationId" type="xs:base64Binary"/>
+        <xs:element minOccurs="0" name="userId" type="xs:string"/>
+      </xs:sequence></xs:complexType></xs:element>
+      <xs:element name="GetCertificateResponse"><xs:complexType><xs:sequence>
+        <xs:element minOccurs="0" name="GetCertificateResult" type="xs:string"/>
+      </xs:sequence></xs:complexType></xs:element>
+      <xs:element name="CCMovelSign"><xs:complexType><xs:sequence>
+        <xs:element minOccurs="0" name="request" type="q1:SignRequest"/>
+      </xs:sequence></xs:complexType></xs:element>
+      <xs:element name="CCMovelSignResponse"><xs:complexType><xs:sequence>
+        <xs:element minOccurs="0" name="CCMovelSignResult" type="q1:SignStatus"/>
+      </xs:sequence></xs:complexType></xs:element>
+      <xs:element name="ValidateOtp"><xs:complexType><xs:sequence>
+        <xs:element minOccurs="0" name="code" type="xs:string"/>
+        <xs:element minOccurs="0" name="processId" type="xs:string"/>
+        <xs:element minOccurs="0" name="applicationId" type="xs:base64Binary"/>
+      </xs:sequence></xs:complexType></xs:element>
+      <xs:element name="ValidateOtpResponse"><xs:complexType><xs:sequence>
+        <xs:element minOccurs="0" name="ValidateOtpResult" type="q1:SignResponse"/>
+      </xs:sequence></xs:complexType></xs:element>
+    </xs:schema>
+  </wsdl:types>
+  <wsdl:message name="GetCertificateIn"><wsdl:part name="parameters" element="tns:GetCertificate"/></wsdl:message>
+  <wsdl:message name="GetCertificateOut"><wsdl:part name="parameters" element="tns:GetCertificateResponse"/></wsdl:message>
+  <wsdl:message name="CCMovelSignIn"><wsdl:part name="parameters" element="tns:CCMovelSign"/></wsdl:message>
+  <wsdl:message name="CCMovelSignOut"><wsdl:part name="parameters" element="tns:CCMovelSignResponse"/></wsdl:message>
+  <wsdl:message name="ValidateOtpIn"><wsdl:part name="parameters" element="tns:ValidateOtp"/></wsdl:message>
+  <wsdl:message name="ValidateOtpOut"><wsdl:part name="parameters" element="tns:ValidateOtpResponse"/></wsdl:message>
+  <wsdl:portType name="CCMovelDigitalSignature">
+    <wsdl:operation name="GetCertificate">
+      <wsdl:input message="tns:GetCertificateIn"/><wsdl:output message="tns:GetCertificateOut"/>
+    </wsdl:operation>
+    <wsdl:operation name="CCMovelSign">
+      <wsdl:input message="tns:CCMovelSignIn"/><wsdl:output message="tns:CCMovelSignOut"/>
+    </wsdl:operation>
+    <wsdl:operation name="ValidateOtp">
+      <wsdl:input message="tns:ValidateOtpIn"/><wsdl:output message="tns:ValidateOtpOut"/>
+    </wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="Binding" type="tns:CCMovelDigitalSignature">
+    <soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="GetCertificate">
+      <soap:operation soapAction="%(svc)sCCMovelDigitalSignature/GetCertificate" style="document"/>
+      <wsdl:input><soap:body use="literal"/></wsdl:input>
+      <wsdl:output><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+    <wsdl:operation name="CCMovelSign">
+      <soap:operation soapAction="%(svc)sCCMovelDigitalSignature/CCMovelSign" style="document"/>
+      <wsdl:input><soap:body use="literal"/></wsdl:input>
+      <wsdl:output><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+    <wsdl:operation name="ValidateOtp">
+      <soap:operation soapAction="%(svc)sCCMovelDigitalSignature/ValidateOtp" style="document"/>
+      <wsdl:input><soap:body use="literal"/></wsdl:input>
+      <wsdl:output><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="CCMovelDigitalSignature">
+    <wsdl:port name="Port" binding="tns:Binding"><soap:address location="http://127.0.0.1/"/></wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+''' % {'svc': SERVICE, 'st': STRUCTURES}
+
+# Cadeia de certificados (utilizador, root, CA) devolvida pelo GetCertificate
+CERTS = ''.join('-----BEGIN CERTIFICATE-----\n%s\n-----END CERTIFICATE-----\n' % cert
+                for cert in ('VVNFUg==', 'Uk9PVA==', 'Q0E='))
+
+RESPONSES = {
+    'GetCertificate': '<GetCertificateResponse xmlns="%s"><GetCertificateResult>%s'
+                      '</GetCertificateResult></GetCertificateResponse>' % (SERVICE, CERTS),
+    'CCMovelSign': '<CCMovelSignResponse xmlns="%s"><CCMovelSignResult>'
+                   '<Code xmlns="%s">200</Code><ProcessId xmlns="%s">p-1</ProcessId>'
+                   '</CCMovelSignResult></CCMovelSignResponse>' % (SERVICE, STRUCTURES, STRUCTURES),
+    'ValidateOtp': '<ValidateOtpResponse xmlns="%s"><ValidateOtpResult>'
+                   '<Signature xmlns="%s">c2ln</Signature><Status xmlns="%s">'
+                   '<Code>%%s</Code><Message>%%s</Message></Status></ValidateOtpResult>'
+                   '</ValidateOtpResponse>' % (SERVICE, STRUCTURES, STRUCTURES),
+}
+
+PIN = '98765432'
+OTP = '123456'
+USER = '+351 912345678'
+APPID = 'b826359c-06f8-425e-8ec3-50a97a418916'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Servidor SCMD (SOAP, /svc) e DSS (REST, /rest) de teste."""
+
+    otp_status = ('200', 'OK')
+    signed = 0                  # número de PDF assinados (signDocument)
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path.startswith('/rest/'):
+            if self.path.endswith('/signDocument'):
+                Handler.signed += 1
+                pdf = base64.b64decode(json.loads(request.decode())['toSignDocument']['bytes'])
+                data = pdf + b' signed %d' % Handler.signed
+            else:
+                data = b'dtbs'
+            self.reply('application/json', json.dumps({'bytes': base64.b64encode(data).decode()}))
+            return
+        op = self.headers['SOAPAction'].strip('"').rsplit('/', 1)[-1]
+        response = RESPONSES[op]
+        if op == 'ValidateOtp':
+            response = response % self.otp_status
+        self.reply('text/xml; charset=utf-8',
+                   '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>%s'
+                   '</s:Body></s:Envelope>' % response)
+
+    def do_OPTIONS(self):
+        self.reply('text/plain', '')
+
+    def reply(self, content_type, body):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RedactTest(unittest.TestCase):
+
+    def test_unprefixed(self):
+        self.assertEqual(cmd_dss_replay.redact('<Pin>1234</Pin>'), '<Pin>***</Pin>')
+        self.assertEqual(cmd_dss_replay.redact(b'<code>99</code>'), '<code>***</code>')
+        self.assertEqual(cmd_dss_replay.redact('<ApplicationId>abc</ApplicationId>'),
+                         '<ApplicationId>***</ApplicationId>')
+        self.assertEqual(cmd_dss_replay.redact('<userId>+351 912345678</userId>'),
+                         '<userId>***</userId>')
+
+    def test_prefixed_with_attributes(self):
+        self.assertEqual(cmd_dss_replay.redact('<ns4:Pin xmlns:ns4="%s">1234</ns4:Pin>' % STRUCTURES),
+                         '<ns4:Pin xmlns:ns4="%s">***</ns4:Pin>' % STRUCTURES)
+        self.assertEqual(cmd_dss_replay.redact('<a:UserId >+351 912345678</a:UserId >'),
+                         '<a:UserId >***</a:UserId >')
+        self.assertEqual(cmd_dss_replay.redact('<x:Pin>1234</y:Pin>'), '<x:Pin>***</y:Pin>')
+
+    def test_empty_elements(self):
+        self.assertEqual(cmd_dss_replay.redact('<Pin/>'), '<Pin/>')
+        self.assertEqual(cmd_dss_replay.redact('<Pin></Pin>'), '<Pin>***</Pin>')
+        # O elemento vazio não se estende ao conteúdo dos elementos seguintes
+        self.assertEqual(cmd_dss_replay.redact('<Pin xsi:nil="true"/><code>99</code>'),
+                         '<Pin xsi:nil="true"/><code>***</code>')
+
+
+class RecordReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.wsdl = os.path.join(self.tmp.name, 'cmd.wsdl')
+        with open(self.wsdl, 'w') as file:
+            file.write(WSDL)
+        self.trace = os.path.join(self.tmp.name, 'trace.jsonl.gz')
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.address = 'http://127.0.0.1:%d/svc' % self.server.server_port
+        self.rest = 'http://127.0.0.1:%d/rest' % self.server.server_port
+        self.infile = os.path.join(self.tmp.name, 'teste.pdf')
+        with open(self.infile, 'wb') as file:
+            file.write(b'%PDF teste')
+        self.outfile = os.path.join(self.tmp.name, 'teste.signed.pdf')
+        patcher = mock.patch.object(Handler, 'signed', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def client(self, session):
+        client = Client(self.wsdl, transport=Transport(session=session))
+        service = client.create_service('{%s}Binding' % SERVICE, self.address)
+        return types.SimpleNamespace(service=service)
+
+    def sign(self, client):
+        args = argparse.Namespace(applicationId=APPID, user=USER, pin=PIN,
+                                  hash=b'\0' * 32, docName='teste.pdf')
+        status = cmd_soap_msg.ccmovelsign(client, args)
+        args = argparse.Namespace(applicationId=APPID, ProcessId=status['ProcessId'], OTP=OTP)
+        return (status, cmd_soap_msg.validate_otp(client, args))
+
+    def signpdf(self, session):
+        """Assina o PDF com signpdf (OTP introduzido com input) e devolve o output."""
+        args = argparse.Namespace(user=USER, pin=PIN, infile=self.infile, outfile=self.outfile,
+                                  datetime=None, cache=None, applicationId=APPID,
+                                  dss_rest=self.rest)
+        otp_input = mock.Mock(return_value=OTP)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            signpdf_cli.signpdf(self.client(session), args, session, otp_input)
+        otp_input.assert_called_once_with('Introduza o OTP recebido no seu dispositivo: ')
+        return output.getvalue()
+
+    def entries(self):
+        with gzip.open(self.trace, 'rt', encoding='UTF-8') as file:
+            return [json.loads(line) for line in file]
+
+    def main(self, n):
+        """Executa cmd_dss_replay.main com n assinaturas e devolve (output, cdigo de sada)."""
+        argv = ['cmd_dss_replay.py', self.trace, self.infile, '-n', str(n),
+                '-outfile', self.outfile]
+        output = io.StringIO()
+        code = 0
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch.object(cmd_soap_msg, 'getclient', lambda env, session: self.client(session)), \
+                mock.patch.object(_signpdf_config, 'get_appid', return_value=APPID), \
+                mock.patch.object(_signpdf_config, 'get_rest', return_value=self.rest), \
+                contextlib.redirect_stdout(output):
+            try:
+                cmd_dss_replay.main()
+            except SystemExit as e:
+                code = e.code
+        return (output.getvalue(), code)
+
+    def test_record_redacts_and_replays(self):
+        session = cmd_dss_replay.record(requests.Session(), self.trace)
+        (status, res) = self.sign(self.client(session))
+        session.get_adapter(self.address).recorder.close()
+        self.assertEqual(status['ProcessId'], 'p-1')
+
+        entries = self.entries()
+        self.assertEqual([entry['op'] for entry in entries], ['CCMovelSign', 'ValidateOtp'])
+        for entry in entries:
+            for secret in (PIN, OTP, USER, APPID, 'YjgyNjM1OWMt', 'teste.pdf'):   # YjgyNjM1OWMt: APPID em base64
+                self.assertNotIn(secret, entry['request'])
+        self.assertIn('Pin xmlns', entries[0]['request'])
+        self.assertIn('***</', entries[1]['request'])
+
+        (status, res) = self.sign(self.client(cmd_dss_replay.replay(self.trace)))
+        self.assertEqual(status['ProcessId'], 'p-1')
+        self.assertEqual(res['Status']['Code'], '200')
+        self.assertEqual(res['Signature'], b'sig')
+
+    def test_dss_rest_record_replay(self):
+        certs_chain = {'sign': 'VVNFUg==', 'ca': 'Q0E=', 'root': 'Uk9PVA=='}
+        signdate = '2020-01-01T00:00:00'
+        pdf = {'bytes': b'%PDF teste', 'name': 'teste.pdf'}
+        res = {'Signature': b'sig'}
+        session = cmd_dss_replay.record(dss_rest_msg.getsession(), self.trace)
+        response = dss_rest_msg.getDataToSign(certs_chain, signdate, pdf, self.rest, session)
+        self.assertEqual(base64.b64decode(response.json()['bytes']), b'dtbs')
+        for i in (1, 2):
+            response = dss_rest_msg.signDocument(certs_chain, signdate, pdf, res, self.rest, session)
+            self.assertEqual(base64.b64decode(response.json()['bytes']), b'%%PDF teste signed %d' % i)
+        session.get_adapter(self.rest).recorder.close()
+
+        entries = self.entries()
+        self.assertEqual([entry['op'] for entry in entries],
+                         ['getDataToSign', 'signDocument', 'signDocument'])
+        for entry in entries:
+            # Dos pedidos REST s  gravado o tamanho (no o PDF nem os certificados)
+            self.assertNotIn('request', entry)
+            self.assertGreater(entry['request_size'], 0)
+            self.assertEqual(entry['status'], 200)
+
+        session = cmd_dss_replay.replay(self.trace)
+        response = dss_rest_msg.getDataToSign(certs_chain, signdate, pdf, self.rest, session)
+        self.assertEqual(base64.b64decode(response.json()['bytes']), b'dtbs')
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        # As respostas ao mesmo pedido so devolvidas pela ordem gravada, em ciclo
+        signed = [base64.b64decode(dss_rest_msg.signDocument(
+            certs_chain, signdate, pdf, res, self.rest, session).json()['bytes']) for i in range(3)]
+        self.assertEqual(signed, [b'%PDF teste signed 1', b'%PDF teste signed 2',
+                                  b'%PDF teste signed 1'])
+        self.assertEqual(Handler.signed, 2)
+
+    def test_replay_not_recorded(self):
+        session = cmd_dss_replay.record(dss_rest_msg.getsession(), self.trace)
+        session.post(self.rest + '/getDataToSign', json={})
+        session.get_adapter(self.rest).recorder.close()
+        session = cmd_dss_replay.replay(self.trace)
+        with self.assertRaises(requests.ConnectionError):
+            session.post(self.rest + '/signDocument', json={})
+
+    def test_signpdf_record_replay(self):
+        session = cmd_dss_replay.record(dss_rest_msg.getsession(), self.trace)
+        output = self.signpdf(session)
+        session.get_adapter(self.rest).recorder.close()
+        self.assertIn('Ficheiro assinado guardado em ' + self.outfile, output)
+        with open(self.outfile, 'rb') as file:
+            self.assertEqual(file.read(), b'%PDF teste signed 1')
+        ops = [entry['op'] for entry in self.entries() if entry['method'] == 'POST']
+        self.assertEqual(sorted(ops), ['CCMovelSign', 'GetCertificate', 'ValidateOtp',
+                                       'getDataToSign', 'signDocument'])
+        os.remove(self.outfile)
+
+        output = self.signpdf(cmd_dss_replay.replay(self.trace))
+        self.assertIn('Ficheiro assinado guardado em ' + self.outfile, output)
+        with open(self.outfile, 'rb') as file:
+            self.assertEqual(file.read(), b'%PDF teste signed 1')
+        self.assertEqual(Handler.signed, 1)
+
+    def test_main(self):
+        session = cmd_dss_replay.record(dss_rest_msg.getsession(), self.trace)
+        self.signpdf(session)
+        session.get_adapter(self.rest).recorder.close()
+        (output, code) = self.main(3)
+        self.assertEqual(code, 0)
+        self.assertIn('3 assinaturas (0 falhadas) em ', output)
+        self.assertNotIn('falhou', output)
+        self.assertEqual(Handler.signed, 1)
+
+    def test_main_reports_failures(self):
+        # Gravao de uma assinatura com sucesso e de outra com OTP errado: na reproduo,
+        # as respostas ao ValidateOtp alternam entre as duas
+        session = cmd_dss_replay.record(dss_rest_msg.getsession(), self.trace)
+        self.signpdf(session)
+        with mock.patch.object(Handler, 'otp_status', ('802', 'OTP errado')):
+            with self.assertRaises(SystemExit):
+                self.signpdf(session)
+        session.get_adapter(self.rest).recorder.close()
+        (output, code) = self.main(4)
+        self.assertEqual(code, 1)
+        self.assertEqual(output.count('falhou'), 2)
+        self.assertIn('Assinatura 2 falhou: Erro 802. OTP errado', output)
+        self.assertIn('Assinatura 4 falhou: Erro 802. OTP errado', output)
+        self.assertIn('4 assinaturas (2 falhadas) em ', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# coding: latin-1
+"""Testes da cache de PDF assinados (signpdf_cache)."""
+
+import os
+import stat
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import dss_rest_msg
+import signpdf_cache
+
+
+CERTS = {'sign': 'U0lHTg==', 'ca': 'Q0E=', 'root': 'Uk9PVA=='}
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def key(self, pdf=b'%PDF', certs=CERTS):
+        return signpdf_cache.cache_key(pdf, '+351 000000000', '2020-02-12T12:45:56', certs)
+
+    def test_same_document(self):
+        self.assertEqual(self.key(), self.key())
+
+    def test_document_and_certificate(self):
+        self.assertNotEqual(self.key(), self.key(pdf=b'%PDF-1.7'))
+        self.assertNotEqual(self.key(), self.key(certs=dict(CERTS, sign='T1VUUk8=')))
+
+    def test_signature_parameters(self):
+        key = self.key()
+        level = dss_rest_msg.SIGNATURE_PARAMETERS['signatureLevel']
+        dss_rest_msg.SIGNATURE_PARAMETERS['signatureLevel'] = 'PAdES_BASELINE_T'
+        try:
+            self.assertNotEqual(key, self.key())
+        finally:
+            dss_rest_msg.SIGNATURE_PARAMETERS['signatureLevel'] = level
+
+
+class SignCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = signpdf_cache.SignCache(os.path.join(self.tmp.name, 'cache'), maxsize=25)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', b'signed')
+        self.assertEqual(self.cache.get('a'), b'signed')
+
+    def test_lru_eviction(self):
+        self.cache.put('a', b'x' * 10)
+        time.sleep(0.02)
+        self.cache.put('b', b'x' * 10)
+        time.sleep(0.02)
+        self.cache.get('a')                # 'b' passa a ser a entrada LRU
+        time.sleep(0.02)
+        self.cache.put('c', b'x' * 10)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+
+    def test_put_failure(self):
+        with mock.patch('signpdf_cache.tempfile.mkstemp', side_effect=OSError(28, 'No space')):
+            self.assertFalse(self.cache.put('a', b'signed'))
+        with mock.patch('signpdf_cache.os.replace', side_effect=OSError(28, 'No space')):
+            self.assertFalse(self.cache.put('a', b'signed'))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_evict_concurrent_removal(self):
+        self.cache.put('a', b'x' * 10)
+        self.cache.put('b', b'x' * 10)
+        os.remove(os.path.join(self.cache.directory, 'a.pdf'))
+        real_scandir = os.scandir
+
+        class Entry:
+            """Entrada de diretoria removida depois do scandir."""
+            name = 'a.pdf'
+            path = os.path.join(self.cache.directory, 'a.pdf')
+
+            def is_file(self, follow_symlinks=True):
+                return True
+
+            def stat(self, follow_symlinks=True):
+                raise FileNotFoundError(self.path)
+
+        def scandir(path):
+            entries = list(real_scandir(path)) + [Entry()]
+            return mock.MagicMock(__enter__=lambda s: iter(entries), __exit__=lambda *a: None)
+
+        with mock.patch('signpdf_cache.os.scandir', scandir):
+            self.cache.evict()
+        self.assertEqual(self.cache.get('b'), b'x' * 10)
+
+    def test_entry_permissions(self):
+        self.cache.put('a', b'signed')
+        mode = os.stat(os.path.join(self.cache.directory, 'a.pdf')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache.directory).st_mode), 0o700)
+
+    def test_refuses_shared_directory(self):
+        shared = os.path.join(self.tmp.name, 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0o777)
+        with self.assertRaises(PermissionError):
+            signpdf_cache.SignCache(shared)
+        os.chmod(shared, 0o750)
+        with self.assertRaises(PermissionError):
+            signpdf_cache.SignCache(shared)
+
+    @unittest.skipUnless(hasattr(os, 'getuid') and os.getuid() == 0, 'requer root (chown)')
+    def test_refuses_foreign_directory(self):
+        foreign = os.path.join(self.tmp.name, 'foreign')
+        os.mkdir(foreign, 0o700)
+        os.chown(foreign, 12345, -1)
+        with self.assertRaises(PermissionError):
+            signpdf_cache.SignCache(foreign)
+
+if __name__ == '__main__':
+    unittest.main()
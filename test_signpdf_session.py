@@ -0,0 +1,112 @@
+# coding: latin-1
+"""Testes das sessões de assinatura pendentes (signpdf_session)."""
+
+import hashlib
+import tracemalloc
+import unittest
+from unittest import mock
+
+import signpdf_session
+
+
+CERTS = {'sign': 'A' * 2000, 'ca': 'B' * 2000, 'root': 'C' * 2000}
+OTHER_CERTS = dict(CERTS, sign='D' * 2000)
+
+
+class Clock:
+    """Relógio (time.monotonic) controlado pelo teste."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('signpdf_session.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = signpdf_session.SessionStore()
+
+    def session(self, process_id, ttl=signpdf_session.TTL, pdf=b'%PDF'):
+        session = signpdf_session.SigningSession(bytes(32), 'teste.pdf',
+                                                 hashlib.sha256(pdf).digest(),
+                                                 '2020-02-12T12:45:56', ttl)
+        session.process_id = process_id
+        return session
+
+    def test_pop(self):
+        session = self.session('p1')
+        self.store.add(session, CERTS)
+        self.assertEqual(self.store.pop('p1'), (session, CERTS))
+        self.assertEqual(self.store.pop('p1'), (None, None))
+
+    def test_pop_after_ttl(self):
+        self.store.add(self.session('p1', ttl=60), CERTS)
+        self.clock.now += 60
+        self.assertEqual(self.store.pop('p1'), (None, None))
+        self.assertEqual(len(self.store), 0)
+
+    def test_expiry_order(self):
+        self.store.add(self.session('late', ttl=30), CERTS)
+        self.store.add(self.session('early', ttl=10), CERTS)
+        self.store.add(self.session('middle', ttl=20), CERTS)
+        self.clock.now += 15
+        self.store.add(self.session('new'), CERTS)
+        self.assertEqual(sorted(self.store.sessions), ['late', 'middle', 'new'])
+        self.clock.now += 10
+        self.store.add(self.session('newer'), CERTS)
+        self.assertEqual(sorted(self.store.sessions), ['late', 'new', 'newer'])
+
+    def test_readd_same_process_id(self):
+        self.store.add(self.session('p1', ttl=10), CERTS)
+        session = self.session('p1', ttl=100)
+        self.store.add(session, CERTS)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.certs[session.cert_ref][1], 1)
+        # A entrada antiga do índice de expiração não remove a nova sessão
+        self.clock.now += 50
+        self.assertEqual(self.store.pop('p1'), (session, CERTS))
+
+    def test_certs_refcount(self):
+        self.store.add(self.session('p1', ttl=10), CERTS)
+        self.store.add(self.session('p2', ttl=100), CERTS)
+        self.store.add(self.session('p3', ttl=100), OTHER_CERTS)
+        self.assertEqual(len(self.store.certs), 2)
+        self.clock.now += 20
+        self.store.pop('p3')
+        self.assertEqual(len(self.store.certs), 1)       # p1 expirou, p2 usa CERTS
+        self.store.pop('p2')
+        self.assertEqual(self.store.certs, {})
+
+    def test_check(self):
+        session = self.session('p1', pdf=b'%PDF')
+        self.assertTrue(session.check(b'%PDF'))
+        self.assertFalse(session.check(b'%PDF alterado'))
+
+    def test_budget(self):
+        # Memória medida por sessão pendente, com a cadeia de certificados partilhada;
+        # 128 bytes para as entradas do dicionário e do índice de expiração.
+        n = 1000
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(n):
+                session = signpdf_session.SigningSession(
+                    hashlib.sha256(b'dtbs %d' % i).digest(), '/tmp/%055d.pdf' % i,
+                    hashlib.sha256(b'pdf %d' % i).digest(), '2020-02-12T12:45:56.000000')
+                session.process_id = '%036d' % i
+                self.store.add(session, CERTS)
+            size = (tracemalloc.get_traced_memory()[0] - before) / n
+        finally:
+            tracemalloc.stop()
+        self.assertLessEqual(session.sizeof(), signpdf_session.BUDGET)
+        self.assertLessEqual(size, signpdf_session.BUDGET + 128)
+
+
+if __name__ == '__main__':
+    unittest.main()